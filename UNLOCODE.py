@@ -1,13 +1,22 @@
+import asyncio
+import json
 import os
-import time
+import re
+from functools import lru_cache
 import streamlit as st
 from dotenv import load_dotenv
 import autogen  # Ensure the autogen package is installed and configured
-import requests
-from bs4 import BeautifulSoup
+import requests_cache
+from lxml import etree, html as lxml_html
 
 # --- Load environment variables from .env ---
 load_dotenv()
+# Opt-in artificial agent latency for demos; off by default so a request costs
+# only the real work it does.
+SIMULATE_DELAY = os.getenv("UNLOCODE_SIMULATE_DELAY", "0") == "1"
+# Opt-in real-LLM path: one structured-JSON completion covering research,
+# lookup and critique instead of three separate round-trips.
+USE_LLM = os.getenv("UNLOCODE_USE_LLM", "0") == "1"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     st.error("OPENAI_API_KEY not found in the .env file!")
@@ -21,42 +30,48 @@ llm_config = {
 }
 
 # --- Define Agents using autogen ---
-research_agent = autogen.AssistantAgent(
-    name="ResearchAgent",
-    llm_config=llm_config,
-    system_message=(
-        "You are a research agent specialized in UN/LOCODE data lookup. "
-        "Retrieve the UN/LOCODE for a given country and city using reliable sources."
-    )
-)
-
-lookup_agent = autogen.AssistantAgent(
-    name="LookupAgent",
-    llm_config=llm_config,
-    system_message=(
-        "You are a lookup agent. Combine the dynamic company abbreviation with the UN/LOCODE's city segment "
-        "to form the final Organization Code."
-    )
-)
-
-critic_agent = autogen.AssistantAgent(
-    name="CriticAgent",
-    llm_config=llm_config,
-    system_message=(
-        "You are a critic agent. Validate that the generated Organization Code is accurate, "
-        "well-grounded in the UN/LOCODE data, and clearly explained."
-    )
-)
-
-lead_agent = autogen.AssistantAgent(
-    name="LeadAgent",
-    llm_config=llm_config,
-    system_message=(
-        "You are the lead agent overseeing the entire UN/LOCODE lookup workflow. "
-        "Coordinate the research, lookup, and critic agents to produce a final, validated "
-        "Organization Code based on the company name, country, and city."
-    )
-)
+@st.cache_resource
+def get_agents() -> dict:
+    """
+    Lazily construct the autogen agents once and share them across sessions.
+    Building them at import time made every Streamlit rerun pay for config
+    validation; caching them also shares one OpenAI client/connection pool.
+    """
+    return {
+        "research": autogen.AssistantAgent(
+            name="ResearchAgent",
+            llm_config=llm_config,
+            system_message=(
+                "You are a research agent specialized in UN/LOCODE data lookup. "
+                "Retrieve the UN/LOCODE for a given country and city using reliable sources."
+            )
+        ),
+        "lookup": autogen.AssistantAgent(
+            name="LookupAgent",
+            llm_config=llm_config,
+            system_message=(
+                "You are a lookup agent. Combine the dynamic company abbreviation with the UN/LOCODE's city segment "
+                "to form the final Organization Code."
+            )
+        ),
+        "critic": autogen.AssistantAgent(
+            name="CriticAgent",
+            llm_config=llm_config,
+            system_message=(
+                "You are a critic agent. Validate that the generated Organization Code is accurate, "
+                "well-grounded in the UN/LOCODE data, and clearly explained."
+            )
+        ),
+        "lead": autogen.AssistantAgent(
+            name="LeadAgent",
+            llm_config=llm_config,
+            system_message=(
+                "You are the lead agent overseeing the entire UN/LOCODE lookup workflow. "
+                "Coordinate the research, lookup, and critic agents to produce a final, validated "
+                "Organization Code based on the company name, country, and city."
+            )
+        ),
+    }
 
 # --- Simulated UNLOCODE Database ---
 # This dictionary simulates a UNLOCODE database for several countries.
@@ -78,24 +93,46 @@ UNLOCODE_DB = {
     }
 }
 
+# Uppercase the city keys once at import time so lookups never re-normalize
+# the database on the hot path.
+_UNLOCODE_DB_UPPER = {
+    country: {city.upper(): code for city, code in cities.items()}
+    for country, cities in UNLOCODE_DB.items()
+}
+
 
 # --- Agent Simulation Functions ---
-def simulate_research_agent(country: str, city: str) -> str:
+@st.cache_data(show_spinner=False, ttl=3600)
+def lookup_unlocode(country: str, city_upper: str) -> str:
     """
-    Simulates the ResearchAgent by looking up the UNLOCODE for the selected country and city.
-    In a production system, this agent might query a live data source or scrape the UNECE URL.
+    Looks up the UNLOCODE for a country and an already-normalized (upper-cased,
+    stripped) city. Memoized per (country, city) so repeat queries skip the
+    scan — and, once backed by a live source, the network hit as well.
     """
-    st.info("ResearchAgent: Looking up UNLOCODE data...")
-    time.sleep(2)  # Simulate delay for research
-    country_data = UNLOCODE_DB.get(country, {})
-    city_upper = city.upper().strip()
-    # Try exact match first; if not found, check if the city string appears in any key.
+    country_data = _UNLOCODE_DB_UPPER.get(country, {})
+    # Fast path: exact match is a single dict hash.
+    code = country_data.get(city_upper)
+    if code is not None:
+        return code
+    # Fallback: check if the city string appears in any key.
     for key, code in country_data.items():
-        if key.upper() == city_upper or city_upper in key.upper():
+        if city_upper in key:
             return code
     return "UNK00"
 
 
+async def simulate_research_agent(country: str, city: str) -> str:
+    """
+    Simulates the ResearchAgent by looking up the UNLOCODE for the selected country and city.
+    In a production system, this agent might query a live data source or scrape the UNECE URL.
+    """
+    if SIMULATE_DELAY:
+        await asyncio.sleep(2)  # Simulate delay for research
+    # Normalize before the cached call so casing/whitespace variants share a key.
+    return lookup_unlocode(country, city.strip().upper())
+
+
+@lru_cache(maxsize=1024)
 def generate_company_abbreviation(company_name: str) -> str:
     """
     Generate a company abbreviation from the company name based on dynamic logic.
@@ -116,49 +153,127 @@ def generate_company_abbreviation(company_name: str) -> str:
     return abbr
 
 
-def simulate_lookup_agent(unlocode: str, company_name: str) -> (str, str, str):
+async def compute_company_abbr(company_name: str) -> str:
     """
-    Simulates the LookupAgent by:
-      1. Generating a company abbreviation from the company name.
-      2. Extracting the location segment (last 3 characters) from the UNLOCODE.
-      3. Concatenating them to form the final Organization Code.
+    The independent half of the LookupAgent: generates the company abbreviation.
+    Depends only on the company name, so it can start before the research result.
+    """
+    if SIMULATE_DELAY:
+        await asyncio.sleep(1)  # Simulate processing delay
+    return generate_company_abbreviation(company_name)
+
+
+def assemble_org_code(unlocode: str, company_abbr: str) -> (str, str):
+    """
+    The dependent half of the LookupAgent: extracts the location segment
+    (last 3 characters) from the UNLOCODE and concatenates it with the
+    company abbreviation to form the final Organization Code.
     """
-    st.info("LookupAgent: Processing data to generate Organization Code...")
-    time.sleep(1)  # Simulate processing delay
-    company_abbr = generate_company_abbreviation(company_name)
     if len(unlocode) >= 5:
         location_code = unlocode[-3:]
     else:
         location_code = "UNK"
-    org_code = company_abbr + location_code
-    return org_code, company_abbr, location_code
+    return company_abbr + location_code, location_code
 
 
-def simulate_critic_agent(org_code: str) -> str:
+async def simulate_critic_agent(org_code: str) -> str:
     """
     Simulates the CriticAgent which validates that the final Organization Code is accurate.
     """
-    st.info("CriticAgent: Validating the Organization Code...")
-    time.sleep(1)
+    if SIMULATE_DELAY:
+        await asyncio.sleep(1)
     return f"Validated: The Organization Code '{org_code}' is correctly generated based on the UNLOCODE data."
 
 
-def lead_agent_orchestrate(country: str, city: str, company_name: str) -> dict:
+_LLM_RESPONSE_KEYS = ("unlocode", "company_abbr", "org_code", "critique")
+
+
+@st.cache_resource
+def get_openai_client():
+    """Shared async OpenAI client, built lazily on first LLM-path request."""
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+
+async def llm_generate_org_code(country: str, city: str, company_name: str) -> dict:
+    """
+    Performs the research, lookup and critic steps in a single structured-JSON
+    completion, saving two network round-trips and prompt encodes versus
+    calling the three agents separately. Raises if the response is missing any
+    expected key or holds a non-string value, so the caller can fall back to
+    the simulated pipeline.
+    """
+    client = get_openai_client()
+    response = await client.chat.completions.create(
+        model=llm_config["model"],
+        temperature=llm_config["temperature"],
+        response_format={"type": "json_object"},
+        messages=[
+            {
+                "role": "system",
+                "content": (
+                    "You combine the ResearchAgent, LookupAgent and CriticAgent roles. "
+                    "Given a country, city and company name: find the UN/LOCODE for the "
+                    "city, derive the company abbreviation, form the Organization Code "
+                    "(abbreviation + last 3 characters of the UN/LOCODE), and critique "
+                    "the result. Respond with a JSON object containing exactly the keys "
+                    '"unlocode", "company_abbr", "org_code" and "critique", all strings. '
+                    'If you cannot find a UN/LOCODE, use "UNK00" as the unlocode.'
+                ),
+            },
+            {
+                "role": "user",
+                "content": f"Country: {country}\nCity: {city}\nCompany name: {company_name}",
+            },
+        ],
+    )
+    payload = json.loads(response.choices[0].message.content)
+    missing = [key for key in _LLM_RESPONSE_KEYS if key not in payload]
+    if missing:
+        raise ValueError(f"LLM response missing keys: {missing}")
+    bad_types = [key for key in _LLM_RESPONSE_KEYS if not isinstance(payload[key], str)]
+    if bad_types:
+        raise ValueError(f"LLM response has non-string values for: {bad_types}")
+    return payload
+
+
+async def lead_agent_orchestrate(country: str, city: str, company_name: str) -> dict:
     """
     The LeadAgent orchestrates the workflow:
       1. Calls the ResearchAgent to retrieve the UNLOCODE.
       2. Calls the LookupAgent to generate the Organization Code using the company name.
       3. Calls the CriticAgent to validate the final result.
+    The research lookup and the lookup-agent processing are independent until the
+    final concatenation, so they run concurrently; only the critic waits on both.
     Returns an aggregated dictionary with all output data.
     """
-    # Step 1: Research Agent lookup
-    unlocode = simulate_research_agent(country, city)
-
-    # Step 2: Lookup Agent to generate final Organization Code
-    org_code, company_abbr, location_code = simulate_lookup_agent(unlocode, company_name)
+    # The shared agent team backs the real (non-simulated) workflow; built
+    # lazily on first use rather than at import.
+    get_agents()
+
+    payload = None
+    if USE_LLM:
+        try:
+            payload = await llm_generate_org_code(country, city, company_name)
+        except Exception as e:
+            st.warning(f"Single-call LLM path failed ({e}); using the agent pipeline.")
+
+    if payload is not None:
+        unlocode = payload["unlocode"]
+        company_abbr = payload["company_abbr"]
+        org_code = payload["org_code"]
+        critique = payload["critique"]
+        location_code = unlocode[-3:] if len(unlocode) >= 5 else "UNK"
+    else:
+        # Steps 1+2: launch both independent pieces of work immediately; only the
+        # trivial final assembly depends on the research result.
+        research_task = asyncio.create_task(simulate_research_agent(country, city))
+        abbr_task = asyncio.create_task(compute_company_abbr(company_name))
+        unlocode, company_abbr = await asyncio.gather(research_task, abbr_task)
+        org_code, location_code = assemble_org_code(unlocode, company_abbr)
 
-    # Step 3: Critic Agent validation
-    critique = simulate_critic_agent(org_code)
+        # Step 3: Critic Agent validation
+        critique = await simulate_critic_agent(org_code)
 
     # Aggregate final output data
     final_output = {
@@ -174,27 +289,56 @@ def lead_agent_orchestrate(country: str, city: str, company_name: str) -> dict:
     return final_output
 
 
+@st.cache_data(show_spinner=False, ttl=600)
+def run_lead_agent(country: str, city: str, company_name: str) -> dict:
+    """
+    Memoized entry point for the UI: drives the async orchestration and caches
+    the result per (country, city, company_name), so repeated clicks with the
+    same inputs skip the whole agent pipeline. The agent progress messages live
+    in the button handler, outside the cache.
+    """
+    return asyncio.run(lead_agent_orchestrate(country, city, company_name))
+
+
 # --- Fetch Country List from UNECE URL ---
-@st.cache_data
+# Persistent HTTP cache (SQLite) shared across Streamlit sessions and restarts;
+# the Streamlit cache below still serves as the in-process layer. CachedSession
+# subclasses requests.Session, so cache misses reuse pooled keep-alive
+# connections instead of paying a fresh TCP+TLS handshake per request.
+_SESSION = requests_cache.CachedSession('unece_cache', backend='sqlite', expire_after=86400)
+_SESSION.headers.update({"User-Agent": "unlocode-lookup/1.0"})
+
+# Compiled once; selects the country-list anchors with the href filter
+# evaluated inside lxml's C core rather than per-link in Python.
+_COUNTRY_ANCHOR_XPATH = etree.XPath("//a[contains(@href, 'service.unece.org')]")
+
+# Matches any character that is neither a (Unicode) letter nor whitespace —
+# the C-level equivalent of all(ch.isalpha() or ch.isspace() for ch in text).
+_NON_ALPHA_SPACE = re.compile(r"[^\w\s]|[\d_]")
+
+
+# cache_resource rather than cache_data: the country list is read-only and
+# ~250 strings, so sharing the object avoids a pickle round-trip per read.
+@st.cache_resource(ttl=86400)
 def fetch_countries_from_unece():
     """
     Attempts to fetch the list of countries from the UNECE UN/LOCODE page.
+    Country anchors are selected with a precompiled XPath, entirely in C.
     If unsuccessful, returns an empty list.
     """
     url = "https://unece.org/trade/cefact/unlocode-code-list-country-and-territory"
     try:
-        response = requests.get(url, timeout=10)
+        response = _SESSION.get(url, timeout=10)
         if response.status_code != 200:
             return []
-        soup = BeautifulSoup(response.text, 'html.parser')
-        # Heuristic: extract all <a> tags with text that looks like country names.
-        country_links = soup.find_all('a', href=lambda x: x and "service.unece.org" in x)
+        # Pass bytes so lxml resolves the document encoding itself.
+        root = lxml_html.fromstring(response.content)
         countries = set()
-        for link in country_links:
-            text = link.get_text(strip=True)
-            if text and all(ch.isalpha() or ch.isspace() for ch in text):
+        for element in _COUNTRY_ANCHOR_XPATH(root):
+            text = element.text_content().strip()
+            if text and not _NON_ALPHA_SPACE.search(text):
                 countries.add(text)
-        return sorted(list(countries))
+        return sorted(countries)
     except Exception as e:
         st.error(f"Error fetching countries: {e}")
         return []
@@ -233,10 +377,7 @@ if not fetched_countries:
     fetched_countries = list(UNLOCODE_DB.keys())
 else:
     # Ensure our known countries are included
-    for c in UNLOCODE_DB.keys():
-        if c not in fetched_countries:
-            fetched_countries.append(c)
-    fetched_countries = sorted(list(set(fetched_countries)))
+    fetched_countries = sorted(set(fetched_countries) | UNLOCODE_DB.keys())
 
 company_name_input = st.text_input("Enter Company Name", "TEST BY KALAI")
 selected_country = st.selectbox("Select Country", fetched_countries)
@@ -246,9 +387,11 @@ if st.button("Generate Organization Code"):
     progress_bar = st.progress(0)
     with st.spinner("Coordinating agents..."):
         progress_bar.progress(20)
-        final_data = lead_agent_orchestrate(selected_country, city_input, company_name_input)
+        st.info("ResearchAgent: Looking up UNLOCODE data...")
+        st.info("LookupAgent: Generating company abbreviation...")
+        st.info("CriticAgent: Validating the Organization Code...")
+        final_data = run_lead_agent(selected_country, city_input, company_name_input)
         progress_bar.progress(80)
-        time.sleep(0.5)
         progress_bar.progress(100)
 
     st.success("Organization Code generation complete!")